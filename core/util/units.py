@@ -197,9 +197,9 @@ def create_formatted_output(param_dict, num_sig_digits=5):
                 sc_fact, unit_prefix = fn.siScale(param_dict[entry]['value'])
                 str_val = '{0:.{1}e}'.format(
                     param_dict[entry]['value'], num_sig_digits - 1)
-                if np.isnan(np.float(str_val)):
+                if np.isnan(float(str_val)):
                     value = np.NAN
-                elif np.isinf(np.float(str_val)):
+                elif np.isinf(float(str_val)):
                     value = np.inf
                 else:
                     value = float('{0:.{1}e}'.format(
@@ -379,7 +379,7 @@ def is_integer(test_value):
     @return: bool, True if the passed value is a integer, otherwise false.
     """
 
-    return type(test_value) in [np.int, np.int8, np.int16, np.int32, np.int64,
+    return type(test_value) in [int, np.int8, np.int16, np.int32, np.int64,
                                 np.uint, np.uint8, np.uint16, np.uint32,
                                 np.uint64]
 
@@ -389,7 +389,7 @@ def is_float(test_value):
 
     @return: bool, True if the passed value is a float, otherwise false.
     """
-    return type(test_value) in [np.float, np.float16, np.float32, np.float64]
+    return type(test_value) in [float, np.float16, np.float32, np.float64]
 
 
 def is_complex(test_value):
@@ -398,7 +398,7 @@ def is_complex(test_value):
     @return: bool, True if the passed value is a complex value, otherwise false.
     """
 
-    return type(test_value) in [np.complex, np.complex64, np.complex128]
+    return type(test_value) in [complex, np.complex64, np.complex128]
 
 
 def in_range(value, lower_limit, upper_limit):
@@ -22,7 +22,6 @@ top-level directory of this distribution and at <https://github.com/Ulm-IQO/qudi
 """
 
 import time
-import operator
 import numpy as np
 
 from core.module import Base, Connector, ConfigOption
@@ -60,6 +59,7 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
             - [0e-6, 300e-6]
             - [150e-6, 160e-6] #FIXME：this is affective
             - [-10.0, 10.0]  # defual axix: a = 0.0
+        settle_on_target: False # True: wait for stage on_target before each pixel dwell
 
     scanner:
         module.Class: 'confocal_logic.ConfocalLogic'
@@ -73,11 +73,16 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
 
     # confocal scanner
     _scanner_position_ranges = ConfigOption('scanner_position_ranges', missing='error')
+    # wait for the stage on_target before each pixel dwell, the stage's own on_target timeout bounds the wait
+    _settle_on_target = ConfigOption('settle_on_target', False)
 
     # connectors
     counterlogic = Connector(interface='CounterLogic')
     stage1 = Connector(interface='MotorInterface')
 
+    # position change per axis (x, y, z, a) below which no move is sent to the stage
+    _axis_epsilon = np.array([1e-9, 1e-9, 1e-9, 1e-9])
+
 
     def __init__(self, config, **kwargs):
         super().__init__(config=config, **kwargs)
@@ -93,8 +98,9 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
             @return: error code (0:OK, -1:error)
         """
 
-        self._counter_logic = self.get_connector('counterlogic')
-        self._stage_hw = self.get_connector('stage1')
+        # resolved once here, everything else uses these two attributes and never the connectors
+        self._counter_logic = self.counterlogic()
+        self._stage_hw = self.stage1()
 
         self._get_position_range_init()
         self._position_range = self.get_position_range()
@@ -102,19 +108,30 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
         for i in range(4):            
             self._middle_xyz_pos[i] = 0.5 * (self._position_range[i][0] + self._position_range[i][1])
 
-        try:
-            self._current_position = np.array(self._get_scanner_position_init())
-        except:
-            self._current_position = self._middle_xyz_pos
+        # lower and upper scan-config limits per axis, kept in sync by set_position_range
+        self._pos_lo = np.array([r[0] for r in self._scanner_position_ranges], dtype=np.float64)
+        self._pos_hi = np.array([r[1] for r in self._scanner_position_ranges], dtype=np.float64)
+
+        # reused by scanner_set_position instead of building a new dict per move
+        self._move_dict = {}
+
+        # The number of counter logic bins to include in count data for a scan pixel
+        self._dwell_cnt_bins = 1
+
+        # The dwell time (seconds) to wait before sampling counter logic counts for the scan pixel
+        self._dwell_delay = 0.02
+
+        self._current_position = np.empty(4, dtype=np.float64)
+        position = self._get_scanner_position_init()
+        # only a position read from the stage lets scanner_set_position skip unchanged axes
+        self._position_known = position is not None
+        if position is None:
+            self._current_position[:] = self._middle_xyz_pos
             self.log.error("Logic interfuse activation: failed !\nSet cross to middle: " + str(self._current_position))
             return -1
-        else:
-            # The number of counter logic bins to include in count data for a scan pixel
-            self._dwell_cnt_bins = 1
 
-            # The dwell time (seconds) to wait before sampling counter logic counts for the scan pixel
-            self._dwell_delay = 0.02
-            return 0
+        self._current_position[:] = position
+        return 0
 
     def on_deactivate(self):
         self.reset_hardware()
@@ -124,6 +141,8 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
 
         @return int: error code (0:OK, -1:error)
         """
+        # an aborted stage stops short of the last commanded position
+        self._position_known = False
         try:
             self._stage_hw.abort()
             time.sleep(0.1)
@@ -180,6 +199,8 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
                 return -1
 
         self._scanner_position_ranges = myrange
+        self._pos_lo = np.array([r[0] for r in myrange], dtype=np.float64)
+        self._pos_hi = np.array([r[1] for r in myrange], dtype=np.float64)
         return 0
 
     def set_voltage_range(self, myrange=None):
@@ -246,44 +267,59 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
 
         @return int: error code (0:OK, -1:error)
         """
-        move_dict = {}
+        move_dict = self._move_dict
+        move_dict.clear()
+        # without a known position every given axis is sent
+        known = self._position_known
 
         if x is not None:
-            if not(self._scanner_position_ranges[0][0] <= x <= self._scanner_position_ranges[0][1]):
-                self.log.error("You want to set x-axis out of scan-config range: {0:f}.".format(x))
+            if not self._check_axis(0, x):
                 return -1
-            self._current_position[0] = np.float(x)
-            move_dict['x'] = self._current_position[0]
+            x = float(x)
+            if not known or abs(x - self._current_position[0]) > self._axis_epsilon[0]:
+                move_dict['x'] = x
 
         if y is not None:
-            if not(self._scanner_position_ranges[1][0] <= y <= self._scanner_position_ranges[1][1]):
-                self.log.error("You want to set y-axis out of scan-config range: {0:f}.".format(y))
+            if not self._check_axis(1, y):
                 return -1
-            self._current_position[1] = np.float(y)
-            move_dict['y'] = self._current_position[1]
+            y = float(y)
+            if not known or abs(y - self._current_position[1]) > self._axis_epsilon[1]:
+                move_dict['y'] = y
 
         if z is not None:
-            if not(self._scanner_position_ranges[2][0] <= z <= self._scanner_position_ranges[2][1]):
-                self.log.error("You want to set z-axis out of scan-config range: {0:f}.".format(z))
+            if not self._check_axis(2, z):
                 return -1
-            self._current_position[2] = np.float(z)
-            move_dict['z'] = self._current_position[2]
+            z = float(z)
+            if not known or abs(z - self._current_position[2]) > self._axis_epsilon[2]:
+                move_dict['z'] = z
 
         if a is not None:
-            if not(self._scanner_position_ranges[3][0] <= a <= self._scanner_position_ranges[3][1]):
-                self.log.error("You want to set a-axis out of scan-config range: {0:f}.".format(a))
+            if not self._check_axis(3, a):
                 return -1
-            self._current_position[3] = np.float(a)
-            move_dict['a'] = self._current_position[3]
+            a = float(a)
+            if not known or abs(a - self._current_position[3]) > self._axis_epsilon[3]:
+                move_dict['a'] = a
+
+        if not move_dict:
+            # already there, spare the stage the round trip
+            return 0
 
         try:
             #self.log.debug("Logic will send to hardware :" + str(move_dict))
             self._stage_hw.move_abs(move_dict)
-            return 0
         except Exception as e:
             self.log.error("Logic interfuse can't set stage position. Check device connection!\n" + str(e))
             return -1
 
+        # only a move the stage accepted counts as the current position
+        for index, axis in enumerate(('x', 'y', 'z', 'a')):
+            if axis in move_dict:
+                self._current_position[index] = move_dict[axis]
+        if len(move_dict) == 4:
+            # every axis was commanded, so the position is known again
+            self._position_known = True
+        return 0
+
     def get_scanner_position(self):
         """ Get the current position of the scanner hardware.
 
@@ -334,33 +370,37 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
             self.log.error('Logic interfuse: The given line to scan is not the right format or array type.')
             return np.array([-1.])
 
-        self.set_up_line(np.shape(line_path)[1])
-
-        count_data = np.zeros(self._line_length)
-        # TODO: is it necessary for line_length to be a class variable?
-
-        for i in range(self._line_length):
-            coords = line_path[:, i]
-            self.scanner_set_position(x=coords[0], y=coords[1], z=coords[2], a=coords[3])
-
-            if i is 0:
-                self.on_target()
-                #waits until the motion has finished
-                #time.sleep(self._dwell_delay)
-            else:
-                time.sleep(self._dwell_delay)
-                # dwell to accumulate count data
+        path = np.asarray(line_path, dtype=np.float64)
+        if path.ndim != 2 or path.shape[0] != 4 or path.shape[1] == 0:
+            self.log.error('Logic interfuse: The given line to scan should have the shape (4, N>0), '
+                           'but has {0} instead.'.format(path.shape))
+            return np.array([-1.])
+        # set_up_line stays the interface entry point, here the length is just recorded
+        self._line_length = path.shape[1]
+
+        # check the whole line against the scan-config range at once, so the pixel loop
+        # can send the positions to the stage without checking them again
+        out_of_range = np.any((path < self._pos_lo[:, None]) | (path > self._pos_hi[:, None]), axis=1)
+        if out_of_range.any():
+            self.log.error('Logic interfuse: The given line to scan is out of scan-config range on axis {0}.'
+                           ''.format(', '.join(ax for ax, bad in zip('xyza', out_of_range) if bad)))
+            return np.array([-1.])
 
-                #self.on_target()
-                #waits until the motion has finished,slow for pixel
+        # the counter logic may change its window length, so this is checked per line
+        count_length = self._counter_logic.countdata.shape[1]
+        if not 1 <= self._dwell_cnt_bins <= count_length:
+            self.log.error('Logic interfuse: The number of dwell count bins should be between 1 and the '
+                           'counter logic window of {0:d}, but is {1} instead.'
+                           ''.format(count_length, self._dwell_cnt_bins))
+            return np.array([-1.])
 
-            # record count data
-            # TODO: how to ensure count begin after stage on target, 
-            # and count for as same time as every pixel ? 
-            this_count_data = self._counter_logic.countdata[0, -self._dwell_cnt_bins:]
-            count_data[i] = np.mean(this_count_data)
+        try:
+            count_data = self._scan_pixels(path)
+        except Exception as e:
+            self.log.error("Logic interfuse can't scan line. Check device connection!\n" + str(e))
+            return np.array([-1.])
 
-        return np.array([count_data]).T
+        return count_data
 
     def close_scanner(self):
         """ Closes the scanner and cleans up afterwards.
@@ -371,8 +411,11 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
             self._stage_hw.abort()
         except:
             self.log.error("Logic interfuse can't close scanner(abort stage). Check device connection!")
+            self._position_known = False
             return -1
 
+        # an aborted stage stops short of the last commanded position
+        self._resync_position()
         return 0
 
     def close_scanner_clock(self):
@@ -389,10 +432,15 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
 
         @param int num_of_bins: How many count bins of data from the counter logic will be used to
                                 provide the count data at a pixel in the scan.
-        @return:
+        @return int: error code (0:OK, -1:error)
         """
+        if num_of_bins < 1:
+            self.log.error('Logic interfuse: The number of dwell count bins should be at least 1, '
+                           'but is {0} instead.'.format(num_of_bins))
+            return -1
 
         self._dwell_cnt_bins = num_of_bins
+        return 0
 
     def set_dwell_delay(self, delay):
         """ Sets the dwell time. This is the waiting time before querying the counter logic
@@ -422,29 +470,44 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
 
 ########################## internal methods ##################################
 
+    def _check_axis(self, index, value):
+        """ Check a position against the scan-config range of one axis.
+
+        @param int index: index of the axis, 0 to 3 for x, y, z, a
+        @param float value: position to check
+
+        @return bool: True if the position is inside the range
+        """
+        if self._pos_lo[index] <= value <= self._pos_hi[index]:
+            return True
+        self.log.error("You want to set {0}-axis out of scan-config range: {1:f}.".format('xyza'[index], value))
+        return False
+
     def _constraints_to_range(self, hw_constraints, axis):
         """ Turn constraints dict from hardware into the  position range
         required for the scanner interface.
 
         @param dict hw_constraints: dictionary from hardware file.
 
-        @param string axis: axis name, should be 'x', 'y', or 'z'.
+        @param string axis: axis name, should be 'x', 'y', 'z' or 'a'.
 
         @return list range: [pos_min, pos_max]
         """
 
-        if axis not in ['x', 'y', 'z']:
+        if axis not in ('x', 'y', 'z', 'a'):
             # TODO: give error
             return [0, 0]
 
-        if 'pos_min' in hw_constraints[axis].keys():
-            pos_min = hw_constraints[axis]['pos_min']
+        axis_constraints = hw_constraints[axis]
+
+        if 'pos_min' in axis_constraints:
+            pos_min = axis_constraints['pos_min']
         else:
             # TODO: give error
             return [0, 0]
-        
-        if 'pos_max' in hw_constraints[axis].keys():
-            pos_max = hw_constraints[axis]['pos_max']
+
+        if 'pos_max' in axis_constraints:
+            pos_max = axis_constraints['pos_max']
         else:
             # TODO: give error
             return [0, 0]
@@ -456,52 +519,144 @@ class ScannerMotorInterfuse(Base, ConfocalScannerInterface):
         """
         hw_constraints = self._stage_hw.get_constraints()
 
-        pos_range = np.zeros((4, 2))
-
-        if 'x' in hw_constraints.keys():
-            pos_range[0] = self._constraints_to_range(hw_constraints, 'x')
-        if 'y' in hw_constraints.keys():
-            pos_range[1] = self._constraints_to_range(hw_constraints, 'y')
-        if 'z' in hw_constraints.keys():
-            pos_range[2] = self._constraints_to_range(hw_constraints, 'z')
-        if 'a' in hw_constraints.keys():
-            pos_range[3] = self._constraints_to_range(hw_constraints, 'a')
+        pos_range = np.array([self._constraints_to_range(hw_constraints, axis) if axis in hw_constraints else [0, 0]
+                              for axis in ('x', 'y', 'z', 'a')], dtype=np.float64)
 
         #FIXME: only xyz
-        stage_range = pos_range.tolist()[0:3]
-        scan_range = self._scanner_position_ranges[0:3]
+        stage_range = pos_range[0:3]
+        scan_range = np.asarray(self._scanner_position_ranges[0:3], dtype=np.float64)
 
         #TODO: merge scan range and motor range in config?
-        if operator.eq(scan_range, stage_range):
+        if np.array_equal(scan_range, stage_range):
             self.log.debug("Config interfuse range xyz: hardware stage constraints == logic scan range.")
         else:
             self.log.warning("Config interfuse warning: hardware stage constraints range NOT equal to logic scan range.\n" + 
-                            "stage range config   ={}\nscanner range config ={}".format(stage_range, scan_range))
+                            "stage range config   ={}\nscanner range config ={}".format(stage_range.tolist(),
+                                                                                       scan_range.tolist()))
+
+    def _resync_position(self):
+        """ Read the stage position back into the current position, e.g. after an abort.
+
+        If the stage cannot be read, the current position is marked as unknown, so that
+        scanner_set_position sends every given axis instead of skipping unchanged ones.
+        """
+        position = self._get_scanner_position_init()
+        self._position_known = position is not None
+        if position is not None:
+            self._current_position[:] = position
 
-    def _get_scanner_position_init(self):
+    def _fast_move(self, move_dict, position):
+        """ Move the stage to a pixel of an already validated line, bypassing scanner_set_position.
+
+        @param dict move_dict: move_abs argument for the pixel
+        @param float[4] position: (x, y, z, a) of the pixel, kept as the current position
+        """
+        if move_dict:
+            self._stage_hw.move_abs(move_dict)
+        self._current_position[:] = position
+
+    def _line_moves(self, path):
+        """ Build the move_abs arguments for all pixels of a line up front.
+
+        @param float[4][N] path: validated positions (x, y, z, a) of the line pixels
+
+        @return list(dict): one {'x': .., 'y': .., 'z': .., 'a': ..} dict per pixel, with Python floats.
+                            The first pixel gets all axes, the others only those that moved
+                            further than _axis_epsilon from the last position sent.
+        """
+        axes = ('x', 'y', 'z', 'a')
+        epsilon = self._axis_epsilon.tolist()
+        positions = path.T.tolist()
+
+        sent = list(positions[0])
+        moves = [dict(zip(axes, sent))]
+        for pos in positions[1:]:
+            move_dict = {}
+            for k, axis in enumerate(axes):
+                if abs(pos[k] - sent[k]) > epsilon[k]:
+                    move_dict[axis] = sent[k] = pos[k]
+            moves.append(move_dict)
+        return moves
+
+    def _scan_pixels(self, path):
+        """ Move through the pixels of a line one after the other and sample the counts at each.
+
+        @param float[4][N] path: validated positions (x, y, z, a) of the line pixels, N > 0
+
+        @return float[N][1]: the photon counts per second at each pixel
+        """
+        moves = self._line_moves(path)
+        positions = path.T
+        length = path.shape[1]
+
+        # bind everything used per pixel to locals, the loop is interpreter bound between USB calls
+        fast_move = self._fast_move
+        on_target = self._stage_hw.on_target
+        sleep = time.sleep
+        counter_logic = self._counter_logic
+        nb = self._dwell_cnt_bins
+        # index of the newest nb bins of the first channel, built once instead of per pixel
+        tail = (0, slice(-nb, None))
+        delay = self._dwell_delay
+        settle = self._settle_on_target
+
+        count_data = np.empty((length, 1), dtype=np.float64)
+        # with several bins per pixel the bins are copied per pixel and averaged once per line
+        samples = np.empty((length, nb), dtype=np.float64) if nb > 1 else None
+        unsettled = 0
+
+        # first pixel: wait until the motion from wherever the stage was has finished
+        fast_move(moves[0], positions[0])
+        self.on_target()
+        if nb == 1:
+            count_data[0, 0] = counter_logic.countdata[0, -1]
+        else:
+            samples[0] = counter_logic.countdata[tail]
+
+        for i in range(1, length):
+            fast_move(moves[i], positions[i])
+
+            # the stage bounds this wait with its own timeout
+            if settle and on_target() != 0:
+                unsettled += 1
+            sleep(delay)
+            # dwell to accumulate count data
+
+            # record count data, countdata is rebound by the counter logic on every
+            # update so it has to be looked up per pixel
+            # TODO: how to ensure count begin after stage on target,
+            # and count for as same time as every pixel ?
+            if nb == 1:
+                count_data[i, 0] = counter_logic.countdata[0, -1]
+            else:
+                samples[i] = counter_logic.countdata[tail]
+
+        if samples is not None:
+            samples.mean(axis=1, out=count_data[:, 0])
+        if unsettled:
+            self.log.warning('Logic interfuse: stage was not on target at {0:d} pixels of the line.'
+                             ''.format(unsettled))
+        return count_data
+
+    def _get_scanner_position_init(self, attempts=2):
         """ Get the current position of the scanner hardware.
 
-        @return float[]: current position in (x, y, z, a).
+        @param int attempts: how often to ask the stage, it may be busy at the first try
+
+        @return float[]: current position in (x, y, z, a), None if the stage could not be read.
         """
-        position = [0.,0.,0.,0.]
-            
-        try:
-            pos_dict = self._stage_hw.get_pos()
-            #self.log.debug("Logic get from hardware: " + str(pos_dict))
-            position = [pos_dict['x'], pos_dict['y'], pos_dict['z'], 0]
-            return position
-        except KeyError as ker:
-            self.log.error("Logic Interfuse can't get stage position from hardware module. Check device connection!")
-            pass
-        except Exception as exc:
-            #self.log.warning("Logic Interfuse can't get stage position. Will try again...")
-            #maybe PZT stage is busy
-            time.sleep(0.1)
+        for attempt in range(attempts):
             try:
                 pos_dict = self._stage_hw.get_pos()
                 #self.log.debug("Logic get from hardware: " + str(pos_dict))
-                position = [pos_dict['x'], pos_dict['y'], pos_dict['z'], 0]
-                return position
-            except KeyError as ker:
-                self.log.error("Logic Interfuse can't get stage position from hardware module, twice. Check device connection!")
-                pass
+                return [pos_dict['x'], pos_dict['y'], pos_dict['z'], 0.]
+            except KeyError:
+                # the stage answered without the xyz axes, asking again will not help
+                break
+            except Exception:
+                #maybe PZT stage is busy
+                if attempt + 1 < attempts:
+                    time.sleep(0.1 * (attempt + 1))
+
+        self.log.error("Logic Interfuse can't get stage position from hardware module. Check device connection!")
+        return None